@@ -1,148 +1,373 @@
+import csv
+import hashlib
+import math
+import re
 import streamlit as st
 import pandas as pd
 import gspread
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from gspread.utils import fill_gaps
 from oauth2client.service_account import ServiceAccountCredentials
-from io import BytesIO
+from io import BytesIO, StringIO
 from fpdf import FPDF
 
 # Constants
 SHEET_ID = "1WeDpcSNnfCrtx4F3bBC9osigPkzy3LXybRO6jpN7BXE"
+SCOPE = ["https://spreadsheets.google.com/feeds",
+         "https://www.googleapis.com/auth/drive"]
 VISIBLE_COLUMNS = ["Service Category", "Item", "Price (USD)", "Turnaround Time", "Notes"]
+PAGE_SIZE = 25  # cards rendered per page; each card is an expander + form with five widgets
 
 st.set_page_config(page_title="💼 Pricing & Services - Cards View", layout="wide")
 
 # --- Utilities ---
 
-def load_gsheet_data(json_data, sheet_id):
-    scope = ["https://spreadsheets.google.com/feeds",
-             "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(json_data, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(sheet_id)
-    worksheet = sheet.get_worksheet(0)
-    df = pd.DataFrame(worksheet.get_all_records())
+@st.cache_resource
+def get_client(json_sha: str, _json_dict: dict):
+    # Keyed on the SHA-256 of the uploaded JSON; the dict itself is never hashed
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(_json_dict, SCOPE)
+    return gspread.authorize(creds)
+
+
+@st.cache_resource(show_spinner=False)
+def get_worksheet(json_sha: str, sheet_id: str, _client):
+    # json_sha is part of the key so a handle is never shared across credentials
+    return _client.open_by_key(sheet_id).get_worksheet(0)
+
+
+@st.cache_data(ttl=60, show_spinner="Refreshing sheet…")
+def load_records(json_sha, sheet_id, _json_dict):
+    # Read the first sheet's values directly, without the metadata request
+    # that opening a Spreadsheet/Worksheet handle costs
+    client = get_client(json_sha, _json_dict)
+    response = client.http_client.values_get(sheet_id, "A:E", params={"valueRenderOption": "UNFORMATTED_VALUE"})
+    values = response.get("values")
+    # An empty sheet has no "values" key at all
+    rows = fill_gaps(values) if values else [VISIBLE_COLUMNS]
+    df = pd.DataFrame(rows[1:], columns=[str(c).strip() for c in rows[0]])[VISIBLE_COLUMNS].copy()
+    df["Price (USD)"] = pd.to_numeric(df["Price (USD)"], errors="coerce")
+    # Categorical keeps the (sorted) category list and compares on int codes
+    df["Service Category"] = df["Service Category"].astype(str).astype("category")
+    # Item + Notes, joined once per load so searching is a single vectorized pass
+    df["_search_blob"] = df["Item"].astype(str) + "\x1f" + df["Notes"].astype(str)
+    return df
+
+
+def load_gsheet_data(json_sha, json_data, sheet_id):
+    client = get_client(json_sha, json_data)
+    if st.session_state.get("worksheet_key") == (json_sha, sheet_id):
+        # The worksheet handle is already cached, so there is nothing to overlap
+        return get_worksheet(json_sha, sheet_id, client), load_records(json_sha, sheet_id, json_data)
+    # Cold load: the worksheet handle (for writes) and the values read are
+    # independent requests, so overlap them instead of paying for both round-trips
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        worksheet = pool.submit(get_worksheet, json_sha, sheet_id, client)
+        df = load_records(json_sha, sheet_id, json_data)
+    worksheet = worksheet.result()
+    st.session_state["worksheet_key"] = (json_sha, sheet_id)
     return worksheet, df
 
 
+def _frame_bytes(df: pd.DataFrame) -> bytes:
+    # Vectorized O(n) content hash, much cheaper than pickling the frame
+    return pd.util.hash_pandas_object(df, index=False).values.tobytes()
+
+
+@st.cache_data(max_entries=16, show_spinner=False, hash_funcs={pd.DataFrame: _frame_bytes})
 def export_pdf(df: pd.DataFrame) -> bytes:
     pdf = FPDF()
     pdf.add_page()
-    pdf.set_font("Arial", size=10)
-    pdf.cell(0, 10, "Pricing & Services", ln=True, align="C")
+    pdf.set_font("Helvetica", size=10)
+    pdf.cell(0, 10, "Pricing & Services", new_x="LMARGIN", new_y="NEXT", align="C")
     pdf.ln(5)
-    col_widths = [40, 50, 25, 40, 35]
+    col_widths = (40, 50, 25, 40, 35)
     headers = VISIBLE_COLUMNS
 
-    for i, h in enumerate(headers):
-        pdf.cell(col_widths[i], 8, h, border=1)
-    pdf.ln()
-    for _, row in df.iterrows():
-        pdf.cell(col_widths[0], 7, str(row["Service Category"]), border=1)
-        pdf.cell(col_widths[1], 7, str(row["Item"]), border=1)
-        pdf.cell(col_widths[2], 7, f"${row['Price (USD)']:.2f}", border=1, align='R')
-        pdf.cell(col_widths[3], 7, str(row["Turnaround Time"]), border=1)
-        pdf.cell(col_widths[4], 7, str(row["Notes"]), border=1)
-        pdf.ln()
-    return pdf.output(dest='S').encode('latin1')
-
-
-def update_row(worksheet, row_number, values):
-    worksheet.update(f"A{row_number}:E{row_number}", [values])
-
-
-def add_service(worksheet, values):
-    worksheet.append_row(values)
-
-
-def delete_row(worksheet, row_number):
-    worksheet.delete_rows(row_number)
-
-
-# --- Main App ---
-
-def main():
-    st.title("💼 Pricing & Services - Card View")
-
-    st.sidebar.header("🔐 Upload Google Service Account JSON")
-    json_file = st.sidebar.file_uploader("Upload your Google Service Account JSON", type=["json"])
-
-    if not json_file:
-        st.warning("⬅️ Upload your Google Service JSON file in the sidebar to continue.")
-        return
+    # Core fonts only cover latin-1, so format and sanitize every cell in one vectorized pass
+    cells = df.assign(**{"Price (USD)": df["Price (USD)"].map("${:.2f}".format)}).astype(str)
+    cells = cells.apply(lambda col: col.str.encode("latin-1", errors="replace").str.decode("latin-1"))
+
+    with pdf.table(col_widths=col_widths, text_align=("LEFT", "LEFT", "RIGHT", "LEFT", "LEFT")) as table:
+        table.row(headers)
+        for cells_row in cells.itertuples(index=False, name=None):
+            table.row(cells_row)
+    return bytes(pdf.output())
+
+
+@st.cache_data(max_entries=16, show_spinner=False, hash_funcs={pd.DataFrame: _frame_bytes})
+def export_excel(df: pd.DataFrame) -> bytes:
+    excel_bytes = BytesIO()
+    # No constant_memory: to_excel writes column by column, and that mode drops
+    # writes to rows it has already flushed
+    with pd.ExcelWriter(excel_bytes, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="Services")
+    return excel_bytes.getvalue()
+
+
+@st.cache_resource
+def _pdf_executor():
+    # Shared across sessions so PDF rendering never runs on the script thread
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def frame_key(df: pd.DataFrame) -> str:
+    return hashlib.sha256(_frame_bytes(df)).hexdigest()
+
+
+def update_rows(worksheet, pending):
+    # pending maps sheet row number -> row values; all ranges go out in one request.
+    # NaN (a blank or non-numeric price on load) is not valid JSON, so it is sent as a blank cell.
+    data = [{"range": f"A{r}:E{r}", "values": [["" if pd.isna(v) else v for v in vals]]}
+            for r, vals in pending.items()]
+    worksheet.batch_update(data, value_input_option="USER_ENTERED")
+
+
+def row_changed(values, original):
+    # Price compares as a number (the sheet may hold 500 where the widget gives 500.0),
+    # with two NaNs counting as equal; the rest compare as text since the sheet may
+    # hold numbers where widgets give str
+    price_pos = VISIBLE_COLUMNS.index("Price (USD)")
+    return any(not (pd.isna(v) and pd.isna(o)) and float(v) != float(o) if pos == price_pos
+               else str(v) != str(o)
+               for pos, (v, o) in enumerate(zip(values, original)))
+
+
+def add_services(worksheet, rows):
+    worksheet.append_rows(rows, value_input_option="USER_ENTERED", insert_data_option="INSERT_ROWS")
+
+
+def _check_bulk_lines(bad, message):
+    if len(bad):
+        raise ValueError(f"{message} (line(s) {', '.join(str(n) for n in bad)}).")
+
+
+def parse_bulk_rows(text):
+    # One service per line, columns in VISIBLE_COLUMNS order, no header
+    lines = [(n, fields) for n, fields in enumerate(csv.reader(StringIO(text), skipinitialspace=True), 1) if fields]
+    _check_bulk_lines([n for n, fields in lines if len(fields) != len(VISIBLE_COLUMNS)],
+                      f"Each line needs exactly {len(VISIBLE_COLUMNS)} fields; quote Notes that contain commas")
+    bulk_df = pd.DataFrame([fields for _, fields in lines], columns=VISIBLE_COLUMNS,
+                           index=[n for n, _ in lines], dtype=object)
+    missing = (bulk_df["Service Category"] == "") | (bulk_df["Item"] == "")
+    _check_bulk_lines(bulk_df.index[missing], "Service Category and Item are required")
+    # A blank price means 0, like the single-add form; anything else must be a number
+    prices = pd.to_numeric(bulk_df["Price (USD)"].replace("", "0"), errors="coerce")
+    _check_bulk_lines(bulk_df.index[prices.isna()], "Price (USD) must be a number")
+    bulk_df["Price (USD)"] = prices.astype(float)
+    return bulk_df.values.tolist()
+
+
+def delete_rows(worksheet, row_numbers):
+    # Merge consecutive rows into [start, end] ranges, then delete bottom-up
+    # so the remaining indices stay valid within the batch
+    ranges = []
+    for r in sorted(set(row_numbers), reverse=True):
+        if ranges and ranges[-1][0] == r + 1:
+            ranges[-1][0] = r
+        else:
+            ranges.append([r, r])
+    requests = [
+        {"deleteDimension": {"range": {"sheetId": worksheet.id, "dimension": "ROWS",
+                                       "startIndex": start - 1, "endIndex": end}}}
+        for start, end in ranges
+    ]
+    worksheet.spreadsheet.batch_update({"requests": requests})
+
+
+@st.fragment(run_every=0.5)
+def _poll_pdf_job(job):
+    # Only this status line reruns on the timer; the page reruns once the PDF is ready
+    if job.done():
+        st.rerun()
+    st.info("⏳ Building PDF in the background…")
+
+
+def render_kpis(df):
+    k1, k2, k3 = st.columns(3)
+    k1.metric("🧾 Total Services", len(df))
+    avg_price = df["Price (USD)"].mean()
+    k2.metric("💲 Avg. Price (USD)", f"${avg_price:.2f}" if not pd.isna(avg_price) else "$0.00")
+    k3.metric("🗂️ Categories", len(df["Service Category"].cat.categories))
+    st.markdown("---")
 
-    # Load JSON
-    try:
-        json_data = json_file.getvalue().decode("utf-8")
-        json_dict = eval(json_data)
-    except Exception as e:
-        st.error(f"Invalid JSON: {e}")
-        return
 
+@st.fragment
+def render_services(json_sha, json_data):
+    # Filter, card, staging and export widgets only rerun this fragment.
+    # The data is read here, not passed in: fragment reruns reuse the arguments
+    # of the last full run, which go stale once Apply Changes writes to the sheet.
     try:
-        worksheet, df = load_gsheet_data(json_dict, SHEET_ID)
+        worksheet, df = load_gsheet_data(json_sha, json_data, SHEET_ID)
     except Exception as e:
         st.error(f"❌ Error loading Google Sheet: {e}")
         return
 
-    df.columns = df.columns.str.strip()
-    df = df[VISIBLE_COLUMNS]
+    if "flash" in st.session_state:
+        st.success(st.session_state.pop("flash"))
 
-    # KPIs
-    k1, k2, k3 = st.columns(3)
-    k1.metric("🧾 Total Services", len(df))
-    avg_price = df["Price (USD)"].mean()
-    k2.metric("💲 Avg. Price (USD)", f"${avg_price:.2f}" if not pd.isna(avg_price) else "$0.00")
-    k3.metric("🗂️ Categories", df["Service Category"].nunique())
-    st.markdown("---")
-
-    # Filters
     st.subheader("🔍 Filter Services")
-    categories = ["All"] + sorted(df["Service Category"].unique())
+    categories = ["All"] + df["Service Category"].cat.categories.tolist()
     selected_cat = st.selectbox("Filter by Category", categories)
-    filtered_df = df.copy()
+    filtered_df = df
     if selected_cat != "All":
         filtered_df = filtered_df[filtered_df["Service Category"] == selected_cat]
 
     search_term = st.text_input("Search Item or Notes")
     if search_term:
-        mask = filtered_df.apply(lambda r: search_term.lower() in str(r["Item"]).lower()
-                                            or search_term.lower() in str(r["Notes"]).lower(), axis=1)
-        filtered_df = filtered_df[mask]
+        pattern = re.compile(re.escape(search_term), re.IGNORECASE)
+        filtered_df = filtered_df[filtered_df["_search_blob"].str.contains(pattern, na=False)]
+    filtered_df = filtered_df[VISIBLE_COLUMNS]
 
     st.markdown("### 📌 Service Items")
 
+    # Edits and deletes are staged here and pushed to the sheet in one batch
+    pending_updates = st.session_state.setdefault("pending_updates", {})
+    pending_deletes = st.session_state.setdefault("pending_deletes", set())
+
+    # Only one page of cards is rendered so the widget count per rerun stays bounded
+    page_count = max(1, math.ceil(len(filtered_df) / PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+    start = (page - 1) * PAGE_SIZE
+    page_df = filtered_df.iloc[start:start + PAGE_SIZE]
+    st.caption(f"Showing {min(start + 1, len(filtered_df))}–{start + len(page_df)} of {len(filtered_df)} services")
+
     # Show each item in an expander card for details + inline editing
-    for idx, row in filtered_df.iterrows():
+    for idx, row_cat, row_item, row_price, row_turn, row_notes in page_df.itertuples(name=None):
         # Calculate row number in sheet (header is row 1, data start at 2)
         sheet_row_num = idx + 2
-        with st.expander(f"🔹 {row['Service Category']} - {row['Item']} (Row #{sheet_row_num})", expanded=False):
+        # Keys carry a digest of the loaded values: when rows shift or change on the
+        # sheet, the card gets fresh widgets instead of the old row's widget state
+        card_key = f"{sheet_row_num}_" + hashlib.sha1(
+            repr((row_cat, row_item, row_price, row_turn, row_notes)).encode()).hexdigest()[:12]
+        status = " ✏️" if sheet_row_num in pending_updates else " 🗑️" if sheet_row_num in pending_deletes else ""
+        with st.expander(f"🔹 {row_cat} - {row_item} (Row #{sheet_row_num}){status}", expanded=False):
 
             # Display fields for edit inside a form
-            with st.form(f"edit_form_{sheet_row_num}"):
+            with st.form(f"edit_form_{card_key}"):
                 col1, col2 = st.columns(2)
-                category = col1.text_input("Service Category", value=row["Service Category"], key=f"cat_{sheet_row_num}")
-                item = col2.text_input("Item", value=row["Item"], key=f"item_{sheet_row_num}")
-                price = st.number_input("Price (USD)", min_value=0.0, value=float(row["Price (USD)"]), format="%.2f", key=f"price_{sheet_row_num}")
-                turnaround = st.text_input("Turnaround Time", value=row["Turnaround Time"], key=f"turn_{sheet_row_num}")
-                notes = st.text_area("Notes", value=row["Notes"], key=f"notes_{sheet_row_num}")
+                category = col1.text_input("Service Category", value=row_cat, key=f"cat_{card_key}")
+                item = col2.text_input("Item", value=row_item, key=f"item_{card_key}")
+                price = st.number_input("Price (USD)", min_value=0.0, value=float(row_price), format="%.2f", key=f"price_{card_key}")
+                turnaround = st.text_input("Turnaround Time", value=row_turn, key=f"turn_{card_key}")
+                notes = st.text_area("Notes", value=row_notes, key=f"notes_{card_key}")
 
                 update_btn = st.form_submit_button("🔄 Update this Service")
                 delete_btn = st.form_submit_button("❌ Delete this Service")
 
                 if update_btn:
-                    try:
-                        values = [category, item, price, turnaround, notes]
-                        update_row(worksheet, sheet_row_num, values)
-                        st.success(f"Row #{sheet_row_num} updated successfully. Please refresh to see changes.")
-                    except Exception as e:
-                        st.error(f"Failed to update row {sheet_row_num}: {e}")
+                    values = [category, item, price, turnaround, notes]
+                    pending_deletes.discard(sheet_row_num)
+                    if row_changed(values, [row_cat, row_item, row_price, row_turn, row_notes]):
+                        pending_updates[sheet_row_num] = values
+                        st.success(f"Row #{sheet_row_num} update staged. Click 💾 Apply Changes below to save it.")
+                    else:
+                        pending_updates.pop(sheet_row_num, None)
+                        st.info(f"Row #{sheet_row_num} is unchanged, nothing to stage.")
 
                 if delete_btn:
-                    try:
-                        delete_row(worksheet, sheet_row_num)
-                        st.warning(f"Row #{sheet_row_num} deleted. Please refresh to update the view.")
-                    except Exception as e:
-                        st.error(f"Failed to delete row {sheet_row_num}: {e}")
+                    pending_deletes.add(sheet_row_num)
+                    pending_updates.pop(sheet_row_num, None)
+                    st.warning(f"Row #{sheet_row_num} delete staged. Click 💾 Apply Changes below to save it.")
+
+    if pending_updates or pending_deletes:
+        st.info(f"📝 {len(pending_updates)} update(s) and {len(pending_deletes)} delete(s) pending.")
+        col_apply, col_discard = st.columns(2)
+        if col_apply.button("💾 Apply Changes"):
+            try:
+                # Re-read the sheet so the diff isn't against cached data, then drop staged
+                # updates that already match it; every write counts against quota
+                load_records.clear()
+                _, current_df = load_gsheet_data(json_sha, json_data, SHEET_ID)
+                changed = {r: v for r, v in pending_updates.items()
+                           if r - 2 not in current_df.index
+                           or row_changed(v, current_df.loc[r - 2, VISIBLE_COLUMNS].tolist())}
+                # Updates go first: they address rows by their pre-delete position
+                if changed:
+                    update_rows(worksheet, changed)
+                if pending_deletes:
+                    delete_rows(worksheet, pending_deletes)
+                pending_updates.clear()
+                pending_deletes.clear()
+                load_records.clear()
+            except Exception as e:
+                st.error(f"Failed to apply changes: {e}")
+            else:
+                # Rerun the whole app so the KPIs and card row numbers reflect the new sheet
+                st.session_state["flash"] = "Changes saved to the sheet."
+                st.rerun()
+        if col_discard.button("↩️ Discard Changes"):
+            pending_updates.clear()
+            pending_deletes.clear()
+            st.rerun()
+
+    # Export buttons
+    st.markdown("---")
+    st.subheader("📤 Export Filtered Data")
+    col_csv, col_excel, col_pdf = st.columns(3)
+    with col_csv:
+        csv_bytes = filtered_df.to_csv(index=False).encode("utf-8")
+        st.download_button("⬇️ Download CSV now", csv_bytes, "services.csv", "text/csv")
+
+    with col_excel:
+        st.download_button("📊 Download Excel", export_excel(filtered_df), "services.xlsx",
+                           "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    with col_pdf:
+        # PDFs are built in the background, keyed by the filtered data they were made from
+        pdf_jobs = st.session_state.setdefault("pdf_jobs", {})
+        job_key = frame_key(filtered_df)
+        job = pdf_jobs.get(job_key)
+        if job is None:
+            if st.button("🖨️ Prepare PDF"):
+                # Only the export for the current filters is worth keeping
+                for old_job in pdf_jobs.values():
+                    old_job.cancel()
+                pdf_jobs.clear()
+                pdf_jobs[job_key] = _pdf_executor().submit(export_pdf, filtered_df.copy())
+                _poll_pdf_job(pdf_jobs[job_key])
+        elif not job.done():
+            _poll_pdf_job(job)
+        else:
+            try:
+                st.download_button("🖨️ Download PDF", job.result(), "services.pdf", "application/pdf")
+            except Exception as e:
+                pdf_jobs.pop(job_key)
+                st.error(f"Failed to build PDF: {e}")
+
+
+# --- Main App ---
+
+def main():
+    st.title("💼 Pricing & Services - Card View")
+
+    st.sidebar.header("🔐 Upload Google Service Account JSON")
+    json_file = st.sidebar.file_uploader("Upload your Google Service Account JSON", type=["json"])
+
+    if not json_file:
+        st.warning("⬅️ Upload your Google Service JSON file in the sidebar to continue.")
+        return
+
+    # Load JSON
+    try:
+        json_bytes = json_file.getvalue()
+        json_dict = orjson.loads(json_bytes)
+        json_sha = hashlib.sha256(json_bytes).hexdigest()
+    except Exception as e:
+        st.error(f"Invalid JSON: {e}")
+        return
+
+    if st.sidebar.button("🔄 Refresh"):
+        load_records.clear()
+
+    try:
+        worksheet, df = load_gsheet_data(json_sha, json_dict, SHEET_ID)
+    except Exception as e:
+        st.error(f"❌ Error loading Google Sheet: {e}")
+        return
+
+    render_kpis(df)
+    render_services(json_sha, json_dict)
 
     st.markdown("---")
     st.subheader("➕ Add New Service")
@@ -160,24 +385,28 @@ def main():
                 st.error("Service Category and Item are required.")
             else:
                 try:
-                    add_service(worksheet, [new_category, new_item, new_price, new_turnaround, new_notes])
-                    st.success("Service added successfully! Please refresh the app to see the latest data.")
+                    add_services(worksheet, [[new_category, new_item, new_price, new_turnaround, new_notes]])
+                    load_records.clear()
+                    st.success("Service added successfully! Click 🔄 Refresh to see the latest data.")
                 except Exception as e:
                     st.error(f"Failed to add service: {e}")
 
-    # Export buttons
-    st.markdown("---")
-    st.subheader("📤 Export Filtered Data")
-    col_csv, col_pdf = st.columns(2)
-    with col_csv:
-        csv_bytes = filtered_df.to_csv(index=False).encode("utf-8")
-        st.download_button("⬇️ Download CSV", csv_bytes, "services.csv", "text/csv")
+    with st.expander("📋 Bulk add (paste CSV)"):
+        with st.form("bulk_add_form"):
+            bulk_text = st.text_area("One service per line: Service Category, Item, Price (USD), Turnaround Time, Notes",
+                                     height=150, help="Quote fields that contain commas.")
+            submit_bulk = st.form_submit_button("✅ Add All")
 
-    with col_pdf:
-        pdf_bytes = export_pdf(filtered_df)
-        st.download_button("🖨️ Download PDF", pdf_bytes, "services.pdf", "application/pdf")
+            if submit_bulk and bulk_text.strip():
+                try:
+                    rows = parse_bulk_rows(bulk_text)
+                    add_services(worksheet, rows)
+                    load_records.clear()
+                    st.success(f"{len(rows)} service(s) added successfully! Click 🔄 Refresh to see the latest data.")
+                except Exception as e:
+                    st.error(f"Failed to add services: {e}")
 
-    st.caption("💡 Please refresh the app (F5) after adding, updating, or deleting services to reload.")
+    st.caption("💡 Sheet data is cached for 60 seconds. Click 🔄 Refresh in the sidebar to reload it sooner.")
 
 if __name__ == "__main__":
     main()